@@ -1,68 +1,93 @@
 #!/usr/bin/env python3
 """Simple CI helper to remind people to set milestones"""
 import os
+from functools import lru_cache
 
 import structlog
 from urllib.parse import urlparse
 from structlog.contextvars import bind_contextvars
-from . import oauth
 
 
 _log = structlog.get_logger(__name__)
 
 GROUP_NAME = "ModioAB"
 DEFAULT_API_URL = "https://gitlab.com/"
-IGNORE_MR_PROJECTS = [
-    "ModioAB/sysadmin",
-    "ModioAB/clientconfig",
-    "ModioAB/caramel-client-rs",
-    "ModioAB/caramel",  # CI only project, own release cycle
-]
-
-IGNORE_RELEASE_PROJECTS = [
-    "ModioAB/mytemp-backend",  # Has its own release tagging procedure
-    "ModioAB/sysadmin",  # Does not follow a release cycle
-    "ModioAB/clientconfig",  # Does not follow a release cycle
-    "ModioAB/modbus_lookup",  # Has it's own release cycle
-    "ModioAB/snmp_lookup",  # Has it's own release cycle
-    "ModioAB/caramel-client-rs",  # Has it's own release cycle
-    "ModioAB/modio-localapi",  # Has it's own release cycle
-    "ModioAB/modio-logger",  # Has it's own release cycle
-    "ModioAB/modio-mqttd",  # Has it's own release cycle
-    "ModioAB/modio-mqttbridge",  # Has it's own release cycle
-    "ModioAB/rust-fsipc",  # Has it's own release cycle
-]
-RELEASE_PROJECTS = [
-    "ModioAB/afase",
-    "ModioAB/mytemp-backend",
-    "ModioAB/modio-api",
-    "ModioAB/zabbix-containers",
-    "ModioAB/submit",
-    "ModioAB/plagiation",
-    "ModioAB/housekeeper",
-    "ModioAB/containers",
-    "ModioAB/grafana-datasource",
-    "ModioAB/grafana-caramel-client",
-    "ModioAB/caramel-manager",
-    "ModioAB/visualisation-editor",
-    "ModioAB/nagger",
-    "ModioAB/manuals",
-    "ModioAB/modio-networks",
-    "ModioAB/mbus-cross",
-    "ModioAB/powercycle",
-    "ModioAB/spilo",
-    "ModioAB/si-battery-control",
-]
+IGNORE_MR_PROJECTS = frozenset(
+    {
+        "ModioAB/sysadmin",
+        "ModioAB/clientconfig",
+        "ModioAB/caramel-client-rs",
+        "ModioAB/caramel",  # CI only project, own release cycle
+    }
+)
+
+IGNORE_RELEASE_PROJECTS = frozenset(
+    {
+        "ModioAB/mytemp-backend",  # Has its own release tagging procedure
+        "ModioAB/sysadmin",  # Does not follow a release cycle
+        "ModioAB/clientconfig",  # Does not follow a release cycle
+        "ModioAB/modbus_lookup",  # Has it's own release cycle
+        "ModioAB/snmp_lookup",  # Has it's own release cycle
+        "ModioAB/caramel-client-rs",  # Has it's own release cycle
+        "ModioAB/modio-localapi",  # Has it's own release cycle
+        "ModioAB/modio-logger",  # Has it's own release cycle
+        "ModioAB/modio-mqttd",  # Has it's own release cycle
+        "ModioAB/modio-mqttbridge",  # Has it's own release cycle
+        "ModioAB/rust-fsipc",  # Has it's own release cycle
+    }
+)
+RELEASE_PROJECTS = frozenset(
+    {
+        "ModioAB/afase",
+        "ModioAB/mytemp-backend",
+        "ModioAB/modio-api",
+        "ModioAB/zabbix-containers",
+        "ModioAB/submit",
+        "ModioAB/plagiation",
+        "ModioAB/housekeeper",
+        "ModioAB/containers",
+        "ModioAB/grafana-datasource",
+        "ModioAB/grafana-caramel-client",
+        "ModioAB/caramel-manager",
+        "ModioAB/visualisation-editor",
+        "ModioAB/nagger",
+        "ModioAB/manuals",
+        "ModioAB/modio-networks",
+        "ModioAB/mbus-cross",
+        "ModioAB/powercycle",
+        "ModioAB/spilo",
+        "ModioAB/si-battery-control",
+    }
+)
+
+
+# Enough connections for our thread pools to keep theirs alive.
+# python-gitlab backs off on 429 by itself, and we ask it to retry transient
+# server errors, so the concurrent requests stay within the rate limits.
+HTTP_POOL_SIZE = 16
+
+# Largest page size GitLab allows, fewer round trips when listing
+PER_PAGE = 100
 
 
 class NoToken(Exception):
     """No token in environment"""
 
 
+class MissingVariable(Exception):
+    """Required variable missing from environment"""
+
+
+class GraphQLError(Exception):
+    """GitLab answered a GraphQL query with errors"""
+
+
+@lru_cache(maxsize=1)
 def get_api_url():
     """Gets a api url from CI variables"""
     val = os.environ.get("CI_API_V4_URL", DEFAULT_API_URL)
-    assert val, "Environment variable: CI_API_V4_URL missing"
+    if not val:
+        raise MissingVariable("Environment variable: CI_API_V4_URL missing")
     # CI_API_.. is a full path, we just need the scheme+domain.
     parsed_uri = urlparse(val)
     result = "{uri.scheme}://{uri.netloc}/".format(uri=parsed_uri)
@@ -70,6 +95,7 @@ def get_api_url():
     return result
 
 
+@lru_cache(maxsize=1)
 def get_api_token():
     """Gets a api token from CI variables"""
     val = os.environ.get("NAGGUS_KEY", "")
@@ -79,13 +105,54 @@ def get_api_token():
     return val
 
 
+# mapping of project id and path_with_namespace => project object
+_projects = {}
+
+
+def lookup_project(gl, project_id):
+    """Get a project by id or path, fetching each project only once per run"""
+    try:
+        return _projects[project_id]
+    except KeyError:
+        pass
+    project = gl.projects.get(project_id)
+    _projects[project.id] = project
+    _projects[project.path_with_namespace] = project
+    return project
+
+
+def graphql(gl, query, **variables):
+    """Run a GraphQL query through gl, with its credentials and retries"""
+    data = gl.http_post(
+        f"{gl.url}/api/graphql",
+        post_data={"query": query, "variables": variables},
+    )
+    if data.get("errors"):
+        raise GraphQLError(data["errors"])
+    return data["data"]
+
+
+@lru_cache(maxsize=1)
+def make_session():
+    """HTTP session with a connection pool sized for our threads, one per run"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@lru_cache(maxsize=1)
 def get_env_gitlab():
     """Create a gitlab instance from CI variables"""
     from gitlab import Gitlab
 
     api_url = get_api_url()
     api_token = get_api_token()
-    gl = Gitlab(api_url, api_token)
+    gl = Gitlab(api_url, api_token, session=make_session(), retry_transient_errors=True)
     # Authenticate so we can get our .user. data
     gl.auth()
     bind_contextvars(API_USER=gl.user.username)
@@ -93,15 +160,38 @@ def get_env_gitlab():
     return gl
 
 
+@lru_cache(maxsize=1)
 def get_oauth_gitlab():
     """Attempt to use oauth to get gitlab"""
     from gitlab import Gitlab
+    from gitlab.exceptions import GitlabAuthenticationError
+    from . import oauth
 
     api_url = get_api_url()
     oa = oauth.GLOauth()
-    token = oa.get_token()
-    gl = Gitlab(api_url, oauth_token=token)
-    gl.auth()
+
+    def oauth_gitlab(token):
+        gl = Gitlab(
+            api_url,
+            oauth_token=token,
+            session=make_session(),
+            retry_transient_errors=True,
+        )
+        gl.auth()
+        return gl
+
+    gl = None
+    cached = oa.cached_token()
+    if cached:
+        try:
+            gl = oauth_gitlab(cached)
+        except GitlabAuthenticationError:
+            # A revoked token stays in the cache until it expires, log in again
+            _log.warning("OAuth token rejected, getting a new one")
+            oa.forget_token()
+    if gl is None:
+        # A refreshed or new token that is rejected is a real error
+        gl = oauth_gitlab(oa.get_token())
     bind_contextvars(API_USER=gl.user.username)
     _log.msg("oauth session")
     return gl
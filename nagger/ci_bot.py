@@ -1,18 +1,65 @@
 #!/usr/bin/env python3
 """Simple CI helper to remind people to set milestones"""
 import os
+import sys
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from typing import Optional
 
 from structlog import get_logger
 from structlog.contextvars import bind_contextvars
+from . import MissingVariable, PER_PAGE, lookup_project
+from .logs import log_state
+from .pool import map_in_context
 
 
 _log = get_logger(__name__)
 
+BAD_NOTE = (
+    "Hello @{author}.\n\n"
+    "You forgot to add a Milestone to this Merge Request.\n\n"
+    "I will try to mark it as `Pending` and `WIP` "
+    "so you do not forget to add a Milestone.\n\n"
+    "Please, make sure the title is descriptive."
+)
+OK_NOTE = (
+    "Hello @{author}.\n\n"
+    "~~You forgot to add a Milestone to this Merge Request.~~\n\n"
+    "~~I will try to mark it as `Pending` and `WIP` "
+    "so you do not forget to add a Milestone.~~\n\n"
+    "Please, make sure the title is descriptive."
+)
+
+
+@dataclass(frozen=True)
+class CIEnv:
+    """The CI variables we use. They do not change while we run."""
+
+    project_id: Optional[str]
+    commit_sha: Optional[str]
+    commit_tag: Optional[str]
+    commit_branch: Optional[str]
+    mr_iid: Optional[str]
+
+
+@lru_cache(maxsize=1)
+def get_ci_env() -> CIEnv:
+    """Read the CI variables once"""
+    env = os.environ
+    return CIEnv(
+        project_id=env.get("CI_PROJECT_ID"),
+        commit_sha=env.get("CI_COMMIT_SHA"),
+        commit_tag=env.get("CI_COMMIT_TAG"),
+        commit_branch=env.get("CI_COMMIT_BRANCH"),
+        mr_iid=env.get("CI_MERGE_REQUEST_IID"),
+    )
+
 
 def get_mr_iid():
     """Gets a merge request id from CI variables"""
-    val = os.environ.get("CI_MERGE_REQUEST_IID")
-    assert val, "Environment variable: CI_MERGE_REQUEST_IID missing"
+    val = get_ci_env().mr_iid
+    if not val:
+        raise MissingVariable("Environment variable: CI_MERGE_REQUEST_IID missing")
     bind_contextvars(CI_MERGE_REQUEST_IID=val)
     return val
 
@@ -20,7 +67,8 @@ def get_mr_iid():
 def get_mr_iid_from_commit(project):
     """Try to guess the MR IIID based on the commit sha."""
     commit_id = get_commit_sha()
-    commit = project.commits.get(commit_id)
+    # Lazy, we only need the commit to reach its merge requests
+    commit = project.commits.get(commit_id, lazy=True)
 
     # unlike project.merge_requests() this returns a list of dicts
     all_mrs = commit.merge_requests()
@@ -33,10 +81,36 @@ def get_mr_iid_from_commit(project):
     return this_mrs
 
 
+def get_open_mrs_from_commit(project):
+    """Get the open MRs for the commit we run on.
+
+    On branch pipelines GitLab can filter on the source branch for us, and
+    the listed MRs are complete, so they need not be fetched one by one.
+    """
+    branch = get_ci_env().commit_branch
+    if branch:
+        bind_contextvars(CI_COMMIT_BRANCH=branch)
+        mrs = project.mergerequests.list(
+            state="opened", source_branch=branch, iterator=True, per_page=PER_PAGE
+        )
+        # Forks can have a branch with the same name, those are not ours
+        return [mr for mr in mrs if mr.source_project_id == project.id]
+
+    this_mrs = get_mr_iid_from_commit(project)
+    if not this_mrs:
+        # An empty iids filter would list every MR in the project
+        return []
+    # One listing for all of them instead of a GET per MR
+    return project.mergerequests.list(
+        state="opened", iids=this_mrs, iterator=True, per_page=PER_PAGE
+    )
+
+
 def get_project_id():
     """Gets a project id from CI variables"""
-    val = os.environ.get("CI_PROJECT_ID")
-    assert val, "Environment variable: CI_PROJECT_ID missing"
+    val = get_ci_env().project_id
+    if not val:
+        raise MissingVariable("Environment variable: CI_PROJECT_ID missing")
     val = int(val)
     bind_contextvars(CI_PROJECT_ID=val)
     return val
@@ -45,173 +119,183 @@ def get_project_id():
 def get_project(api):
     """Get the current project from CI variables"""
     proj_id = get_project_id()
-    project = api.projects.get(proj_id)
+    project = lookup_project(api, proj_id)
     bind_contextvars(project=project.path_with_namespace)
     return project
 
 
 def get_commit_tag():
     """Gets commit tag"""
-    val = os.environ.get("CI_COMMIT_TAG")
-    assert val, "Environment variable: CI_COMMIT_TAG missing"
+    val = get_ci_env().commit_tag
+    if not val:
+        raise MissingVariable("Environment variable: CI_COMMIT_TAG missing")
     bind_contextvars(CI_COMMIT_TAG=val)
     return val
 
 
 def get_commit_sha():
-    """Gets commit tag"""
-    val = os.environ.get("CI_COMMIT_SHA")
-    assert val, "Environment variable: CI_COMMIT_SHA missing"
+    """Gets commit sha"""
+    val = get_ci_env().commit_sha
+    if not val:
+        raise MissingVariable("Environment variable: CI_COMMIT_SHA missing")
     bind_contextvars(CI_COMMIT_SHA=val)
     return val
 
 
-def remove_own_emoji(thing, user_id, emoji="house"):
-    """Remove an emoji owned by user_id from thing"""
-    emojis = thing.awardemojis.list()
-    my_emojis = (e for e in emojis if e.user["id"] == user_id)
-    to_remove = [e for e in my_emojis if e.name == emoji]
+def remove_own_emoji(thing, user_id, emoji="house", emojis=None):
+    """Remove an emoji owned by user_id from thing
+
+    Pass emojis if they are already fetched from thing, to save a request.
+    A passed list is kept up to date with the removals.
+    """
+    if emojis is None:
+        emojis = thing.awardemojis.list(iterator=True, per_page=PER_PAGE)
+    to_remove = [e for e in emojis if e.name == emoji and e.user["id"] == user_id]
     for e in to_remove:
         bind_contextvars(emoji_removed=emoji)
         e.delete()
+        if isinstance(emojis, list):
+            emojis.remove(e)
     return bool(to_remove)
 
 
-def add_own_emoji(thing, user_id, emoji="house"):
-    """Remove an emoji owned by user_id from thing"""
-    emojis = thing.awardemojis.list()
-    my_emojis = (e for e in emojis if e.user["id"] == user_id)
-    matching = [e for e in my_emojis if e.name == emoji]
-    if not matching:
+def add_own_emoji(thing, user_id, emoji="house", emojis=None):
+    """Add an emoji owned by user_id to thing
+
+    Pass emojis if they are already fetched from thing, to save a request.
+    A passed list is kept up to date with the addition.
+    """
+    if emojis is None:
+        emojis = thing.awardemojis.list(iterator=True, per_page=PER_PAGE)
+    if not any(e.name == emoji and e.user["id"] == user_id for e in emojis):
         bind_contextvars(emoji_added=emoji)
-        thing.awardemojis.create({"name": emoji})
+        created = thing.awardemojis.create({"name": emoji})
+        if isinstance(emojis, list):
+            emojis.append(created)
 
 
 def fun_debug_variables():
     """Print all CI related variables"""
-    ci_keys = (k for k in os.environ if k.startswith("CI"))
-    for key in sorted(ci_keys):
-        val = os.environ[key]
-        print(f"{key}={val}")
+    ci_vars = sorted((k, v) for k, v in os.environ.items() if k.startswith("CI"))
+    # One write, line buffered stdout would otherwise flush per variable
+    sys.stdout.write("".join(f"{key}={val}\n" for key, val in ci_vars))
 
 
-def make_pending(thing):
-    """Make sure thing is not Ready, but is Pending"""
-    labels = set(thing.labels)
-    try:
-        labels.remove("Ready")
+def make_pending_wip(thing):
+    """Mark thing as WIP and Pending rather than Ready, in a single save
+
+    Returns False if saving failed.
+    """
+    old_title = thing.title
+    old_labels = thing.labels
+    if not thing.work_in_progress:
+        thing.title = f"WIP: {old_title}"
+        bind_contextvars(title=thing.title)
+
+    # Keep the label order, so GitLab only sees a change when there is one
+    labels = [label for label in old_labels if label != "Ready"]
+    if len(labels) != len(old_labels):
         bind_contextvars(removed_label="Ready")
-    except KeyError:
-        pass
-    labels.add("Pending")
-    bind_contextvars(added_label="Pending")
+    if "Pending" not in labels:
+        labels.append("Pending")
+        bind_contextvars(added_label="Pending")
+    if labels != old_labels:
+        thing.labels = labels
+
+    if thing.title == old_title and labels == old_labels:
+        return True
     try:
-        thing.labels = list(labels)
         thing.save()
     except Exception:
-        _log.exception("Error saving labels, permission error?")
-
+        _log.exception("Error saving title and labels, permission error?")
+        # Roll back so a later save does not push the rejected changes
+        thing.title = old_title
+        thing.labels = old_labels
+        return False
+    return True
+
+
+def list_notes_and_emojis(mr):
+    """List notes and award emojis of mr concurrently
+
+    Notes come back as an iterator, oldest first, where only the first page is
+    fetched up front, so looking for our own early note can stop paging.
+    """
+    notes = partial(
+        mr.notes.list,
+        iterator=True,
+        per_page=PER_PAGE,
+        order_by="created_at",
+        sort="asc",
+    )
 
-def make_wip(thing):
-    """Mark thing as WIP"""
-    if thing.work_in_progress:
-        return
+    def emojis():
+        return list(mr.awardemojis.list(iterator=True, per_page=PER_PAGE))
 
-    old_title = thing.title
-    thing.title = f"WIP: {old_title}"
-    bind_contextvars(title=thing.title)
-    try:
-        thing.save()
-    except Exception:
-        _log.exception("Error saving title, permission error?")
+    return map_in_context(lambda listing: listing(), (notes, emojis))
 
 
-def nag_this_mr(api, mr):
+def nag_this_mr(api, mr, user_id=None):
     """Nag on a single mr"""
-    user_id = api.user.id
-    project = api.projects.get(mr.project_id)
+    if user_id is None:
+        user_id = api.user.id
+    project = lookup_project(api, mr.project_id)
 
     author = mr.author["username"]
-    bind_contextvars(
+    with log_state(
         project=project.path_with_namespace,
         mr_title=mr.title,
         author=author,
         nagger_user_id=user_id,
-    )
-
-    bad_note = (
-        f"Hello @{author}.\n\n"
-        "You forgot to add a Milestone to this Merge Request.\n\n"
-        "I will try to mark it as `Pending` and `WIP` "
-        "so you do not forget to add a Milestone.\n\n"
-        "Please, make sure the title is descriptive."
-    )
-    ok_note = (
-        f"Hello @{author}.\n\n"
-        "~~You forgot to add a Milestone to this Merge Request.~~\n\n"
-        "~~I will try to mark it as `Pending` and `WIP` "
-        "so you do not forget to add a Milestone.~~\n\n"
-        "Please, make sure the title is descriptive."
-    )
-
-    if mr.milestone is None:
-        bind_contextvars(missing_milestone=True, commented=False)
-        remove_own_emoji(mr, user_id=user_id, emoji="house")
-        add_own_emoji(mr, user_id=user_id, emoji="house_abandoned")
-        own_notes = [n for n in mr.notes.list() if n.author["id"] == user_id]
-        if not own_notes:
-            mr.notes.create({"body": bad_note})
-            bind_contextvars(commented=True)
-
-        # in case we have an old modification (save failed) we re-load from
-        # server
-        mr = project.mergerequests.get(mr.iid)
-        if not mr.work_in_progress:
-            make_wip(mr)
-
-        # in case we have an old modification (save failed) we re-load from
-        # server
-        mr = project.mergerequests.get(mr.iid)
-        if ("Ready" in mr.labels) or ("Pending" not in mr.labels):
-            make_pending(mr)
-
-        _log.msg("Updated MR due to missing Milestone")
-    else:
-        own_notes = [n for n in mr.notes.list() if n.author["id"] == user_id]
-        if own_notes:
-            # We keep the first note, but update it
-            note = own_notes.pop()
-            add_own_emoji(note, user_id=user_id, emoji="thumbsup")
-            if note.body != ok_note:
+    ):
+        if mr.milestone is None:
+            notes, emojis = list_notes_and_emojis(mr)
+            remove_own_emoji(mr, user_id=user_id, emoji="house", emojis=emojis)
+            add_own_emoji(mr, user_id=user_id, emoji="house_abandoned", emojis=emojis)
+            # Stops paging at our first note
+            has_note = any(n.author["id"] == user_id for n in notes)
+            if not has_note:
+                mr.notes.create({"body": BAD_NOTE.format(author=author)})
+            bind_contextvars(missing_milestone=True, commented=not has_note)
+
+            make_pending_wip(mr)
+
+            _log.msg("Updated MR due to missing Milestone")
+        else:
+            ok_note = OK_NOTE.format(author=author)
+            notes, emojis = list_notes_and_emojis(mr)
+            own_notes = (n for n in notes if n.author["id"] == user_id)
+            # We keep the first note, but update it. The thumbsup goes on
+            # together with the new body, so a note that already reads ok
+            # needs no requests at all.
+            note = next(own_notes, None)
+            if note is not None and note.body != ok_note:
+                add_own_emoji(note, user_id=user_id, emoji="thumbsup")
                 note.body = ok_note
                 note.save()
-        # Delete any extra notes
-        for note in own_notes:
-            _log.msg("Deleting extra note", note_id=note.id, note_body=note.body)
-            note.delete()
+            # Delete any extra notes, collected first as deleting shifts pages
+            for note in list(own_notes):
+                _log.msg("Deleting extra note", note_id=note.id, note_body=note.body)
+                note.delete()
 
-        remove_own_emoji(mr, user_id=user_id, emoji="house_abandoned")
-        add_own_emoji(mr, user_id=user_id, emoji="house")
-        _log.msg("Removing ugly emoji due to having Milestone")
+            remove_own_emoji(
+                mr, user_id=user_id, emoji="house_abandoned", emojis=emojis
+            )
+            add_own_emoji(mr, user_id=user_id, emoji="house", emojis=emojis)
+            _log.msg("Removing ugly emoji due to having Milestone")
 
 
 def mr_nag(gl):
     """Merge request nagger. meant to be run in a CI job"""
     project = get_project(api=gl)
 
-    mrs = []
-    try:
-        mr_iid = get_mr_iid()
-        mrs = [project.mergerequests.get(mr_iid)]
-    except Exception:
-        pass
-
-    if not mrs:
-        this_mrs = get_mr_iid_from_commit(project)
-        mrs = [project.mergerequests.get(mr_id) for mr_id in this_mrs]
+    if get_ci_env().mr_iid:
+        mrs = [project.mergerequests.get(get_mr_iid())]
+    else:
+        mrs = get_open_mrs_from_commit(project)
 
-    for mr in mrs:
-        nag_this_mr(gl, mr)
+    # Each MR runs in its own copy of the log context
+    map_in_context(partial(nag_this_mr, gl, user_id=gl.user.id), mrs)
 
 
 def release_tag(gl):
@@ -220,23 +304,20 @@ def release_tag(gl):
 
     tagname = get_commit_tag()
 
-    all_rels = project.releases.list()
-    for rel in all_rels:
-        print(rel)
-        print(vars(rel))
-
     try:
         release = project.releases.get(tagname)
     except Exception:
         # Releases.get(foo)  raises 403 if not found
         release = None
-        pass
-
     if release:
         _log.msg("Release found, bailing")
         return
 
-    tag = project.tags.get(tagname)
+    # The tag and commit lookups do not depend on each other
+    tag, commit = map_in_context(
+        lambda fetch: fetch(tagname), [project.tags.get, project.commits.get]
+    )
+
     assert tag, "Missing tag even though CI said it exists"
     if not tag.message:
         _log.msg("Error, no message for tag")
@@ -247,7 +328,6 @@ def release_tag(gl):
     header = message[0]
     description = "\n".join(message[1:])
 
-    commit = project.commits.get(tagname)
     _log.msg("got commit", commit=vars(commit))
 
     #    commit = project.commits.get(ref_name=tagname)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 """Simple cli part for nagger"""
+import logging
 import os
 import sys
 
@@ -7,24 +8,35 @@ import click
 from . import get_env_gitlab, get_oauth_gitlab, NoToken
 from . import ci_bot
 from . import release
+from .logs import QueueLoggerFactory
 
 import structlog.contextvars
 
 log = structlog.get_logger()
+_logger_factory = None
 
 
 def setup_logging():
-    """Global state. Eat it"""
+    """Global state. Eat it. Only the first call configures anything"""
+    global _logger_factory
+    if _logger_factory is not None:
+        return
+    _logger_factory = QueueLoggerFactory(sys.stderr)
+    _logger_factory.stop_on_crash()
+    # Debug output is opt-in, everything below the level is a no-op method
+    level = logging.DEBUG if os.environ.get("NAGGER_DEBUG") else logging.INFO
+    # The filtering logger drops events below level before any processor
+    # runs, and already sets exc_info for .exception()
     structlog.configure(
         processors=[
             structlog.contextvars.merge_contextvars,
-            structlog.processors.StackInfoRenderer(),
-            structlog.dev.set_exc_info,
             structlog.processors.format_exc_info,
             structlog.processors.TimeStamper(fmt="%Y-%m-%d %H:%M.%S", utc=False),
             structlog.dev.ConsoleRenderer(colors=True),
         ],
-        logger_factory=structlog.PrintLoggerFactory(sys.stderr),
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        logger_factory=_logger_factory,
+        cache_logger_on_first_use=True,
     )
     structlog.contextvars.clear_contextvars()
     log.debug("Logging, debug, initialized")
@@ -41,10 +53,17 @@ def _prompt_milestone(gl, milestone: str) -> str:
     return milestone
 
 
+def setup_command_logging(ctx):
+    """Set up logging, except for commands that must not touch it"""
+    if ctx.invoked_subcommand != "debug-variables":
+        setup_logging()
+
+
 @click.group()
-def bot():
+@click.pass_context
+def bot(ctx):
     """Bot (CI) commands"""
-    setup_logging()
+    setup_command_logging(ctx)
 
 
 @bot.command()
@@ -57,7 +76,6 @@ def debug_variables():
 @bot.command()
 def nag():
     """Merge request nagger. meant to be run in a CI job"""
-    setup_logging()
     gl = get_env_gitlab()
     ci_bot.mr_nag(gl)
 
@@ -65,7 +83,6 @@ def nag():
 @bot.command()
 def tag_to_release():
     """Turn a tag to a release object."""
-    setup_logging()
     gl = get_env_gitlab()
     ci_bot.release_tag(gl)
 
@@ -84,7 +101,6 @@ def milestone(ctx):
 @click.argument("milestone", required=False)
 def changelog(milestone):
     """Generate changelog for milestone"""
-    setup_logging()
     try:
         gl = get_env_gitlab()
     except NoToken:
@@ -99,7 +115,6 @@ def changelog(milestone):
 @click.argument("milestone", required=False)
 def changelog_homepage(milestone, dry_run):
     """Export non-internal changelog to the homepage."""
-    setup_logging()
     try:
         gl = get_env_gitlab()
     except NoToken:
@@ -114,7 +129,6 @@ def changelog_homepage(milestone, dry_run):
 @click.argument("milestone", required=False)
 def changelog_wiki(milestone, dry_run):
     """Export complete changelog to the wiki."""
-    setup_logging()
     try:
         gl = get_env_gitlab()
     except NoToken:
@@ -131,7 +145,6 @@ def milestone_wiki(milestone, dry_run):
 
     MILESTONE    is primary Agile and in second hand Group.
     """
-    setup_logging()
     try:
         gl = get_env_gitlab()
     except NoToken:
@@ -147,7 +160,6 @@ def milestone_wiki(milestone, dry_run):
 def fixup(ctx, dry_run, milestone):
     """Stomp all over the milestone and attempt to fix Merge requests and
     issues."""
-    setup_logging()
     try:
         gl = get_env_gitlab()
     except NoToken:
@@ -161,7 +173,6 @@ def fixup(ctx, dry_run, milestone):
 @click.argument("tag-name")
 def tag_release(dry_run, tag_name):
     """Try to tag all projects involved with the milestone."""
-    setup_logging()
     assert tag_name.count(".") >= 2, "A full tag name, eg v3.15.0"
     try:
         gl = get_env_gitlab()
@@ -170,7 +181,10 @@ def tag_release(dry_run, tag_name):
     release.milestone_release(gl, tag_name, dry_run)
 
 
-cli = click.CommandCollection(sources=[milestone, bot])
+# Running the collection skips the group callbacks, set up logging here once
+cli = click.CommandCollection(
+    sources=[milestone, bot], callback=click.pass_context(setup_command_logging)
+)
 
 
 @milestone.command()
@@ -179,7 +193,6 @@ cli = click.CommandCollection(sources=[milestone, bot])
 @click.argument("target_milestone", required=False)
 def move_milestone_items(dry_run, milestone, target_milestone):
     """Move open issues and mrs from milestone to target milestone"""
-    setup_logging()
     try:
         gl = get_env_gitlab()
     except NoToken:
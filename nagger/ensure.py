@@ -16,13 +16,17 @@ def gitlab_file_exists(project, file_path, branch="main"):
 
 def ensure_branch(project, branch_name):
     """Make sure a branch named "branch_name" exists in the project"""
-    branches = project.branches.list(iterator=True)
-    found_branches = [br for br in branches if br.name == branch_name]
-    if found_branches:
-        _log.info(
-            "Found branch", branch_name=branch_name, branch_total=len(found_branches)
-        )
-        return found_branches[0]
+    from gitlab.exceptions import GitlabGetError
+
+    try:
+        branch = project.branches.get(branch_name)
+    except GitlabGetError as ex:
+        # Only a missing branch should be created, anything else is an error
+        if ex.response_code != 404:
+            raise
+    else:
+        _log.info("Found branch", branch_name=branch_name)
+        return branch
 
     branch_obj = {
         "branch": branch_name,
@@ -35,7 +39,7 @@ def ensure_branch(project, branch_name):
 
 def ensure_mr(project, mr_title):
     """Make sure an MR named mr_title  exists in the project"""
-    mrs = project.mergerequests.list(iterator=True)
+    mrs = project.mergerequests.list(search=mr_title, iterator=True)
     found_mrs = [m for m in mrs if m.title == mr_title]
     if found_mrs:
         _log.info("Found mr", mr_title=mr_title, mr_total=len(found_mrs))
@@ -1,3 +1,9 @@
+import atexit
+import os
+import queue
+import signal
+import sys
+import threading
 from contextlib import contextmanager
 from structlog.contextvars import bind_contextvars, unbind_contextvars
 
@@ -9,3 +15,78 @@ def log_state(*args, **kws):
         yield
     finally:
         unbind_contextvars(*kws)
+
+
+class QueueLogger:
+    """structlog logger that hands rendered lines to a writer thread."""
+
+    def __init__(self, write):
+        self._write = write
+
+    def msg(self, message):
+        self._write(message)
+
+    log = debug = info = warn = warning = msg
+    fatal = failure = err = error = critical = exception = msg
+
+
+class QueueLoggerFactory:
+    """Write log lines to file from a background thread.
+
+    Keeps slow stderr (CI log collectors, remote terminals) off the path of
+    the code doing the logging. Lines are drained at interpreter exit, and
+    written directly once the factory is stopped.
+    """
+
+    _STOP = object()
+
+    def __init__(self, file=None):
+        self._file = file if file is not None else sys.stderr
+        self._queue = queue.SimpleQueue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _drain(self):
+        while True:
+            line = self._queue.get()
+            if line is self._STOP:
+                break
+            print(line, file=self._file, flush=True)
+
+    def _write(self, line):
+        if self._stopped:
+            print(line, file=self._file, flush=True)
+        else:
+            self._queue.put(line)
+
+    def stop(self):
+        """Flush all pending lines and stop the writer thread."""
+        self._stopped = True
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def stop_on_crash(self):
+        """Flush pending lines before a traceback, and on SIGTERM.
+
+        atexit handlers run after the traceback is printed, and not at all
+        when the process is terminated by a signal.
+        """
+        excepthook = sys.excepthook
+
+        def on_exception(*exc_info):
+            self.stop()
+            excepthook(*exc_info)
+
+        def on_sigterm(signum, frame):
+            self.stop()
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        sys.excepthook = on_exception
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+    def __call__(self, *args):
+        return QueueLogger(self._write)
@@ -1,13 +1,23 @@
+import json
+import os
+import time
 import uuid
+from pathlib import Path
 
 from oauthlib.oauth2 import WebApplicationClient
-import requests
 
 from structlog import get_logger
+from . import make_session
 
 _log = get_logger(__name__)
 
 
+def token_cache_path() -> Path:
+    """Where we keep the last OAuth token between runs."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return Path(cache_home) / "nagger" / "token.json"
+
+
 def get_webserver_response(authorization_url, redirect_url):
     """Launch webserver and make request.
 
@@ -55,7 +65,8 @@ class GLOauth:
     REDIRECT_URI = "http://localhost:8000"
 
     def __init__(self):
-        self.session = requests.Session()
+        # Shares connections with the Gitlab client, both talk to gitlab.com
+        self.session = make_session()
         self.state = uuid.uuid4().hex
         self.client = WebApplicationClient(client_id=self.CLIENT_ID)
 
@@ -92,9 +103,79 @@ class GLOauth:
         if not resp.ok:
             _log.error(f"Error from server(remove ~/.netrc?): {data}")
             resp.raise_for_status()
+        self.save_token(data)
+        return data["access_token"]
+
+    def step_refresh_token(self, refresh_token):
+        """Trade a refresh token for a new access token, None on failure."""
+        body = self.client.prepare_refresh_body(
+            refresh_token=refresh_token,
+            client_id=self.CLIENT_ID,
+            redirect_uri=self.REDIRECT_URI,
+        )
+        resp = self.session.post(self.TOKEN_URL, body)
+        if not resp.ok:
+            _log.warning("Could not refresh token", status=resp.status_code)
+            return None
+        data = resp.json()
+        self.save_token(data)
         return data["access_token"]
 
+    def load_cached_token(self):
+        """Return the cached token data, or None if there is none."""
+        try:
+            return json.loads(token_cache_path().read_text())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def token_expired(data):
+        """Is the access token in data expired or about to expire?"""
+        expires_in = data.get("expires_in")
+        if expires_in is None:
+            return False
+        # Leave a minute of margin for the requests we are about to make
+        expires_at = data.get("created_at", 0) + expires_in - 60
+        return expires_at < time.time()
+
+    def save_token(self, data):
+        """Store token data readable by the current user only."""
+        data.setdefault("created_at", int(time.time()))
+        path = token_cache_path()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            # The mode above only applies when the file is created
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+        except OSError as e:
+            _log.warning("Could not cache token", path=str(path), error=str(e))
+
+    def forget_token(self):
+        """Remove the cached token, for when the server no longer accepts it."""
+        try:
+            token_cache_path().unlink()
+        except FileNotFoundError:
+            pass
+
+    def cached_token(self):
+        """Return the cached access token if it has not expired, else None."""
+        data = self.load_cached_token() or {}
+        if data.get("access_token") and not self.token_expired(data):
+            return data["access_token"]
+        return None
+
     def get_token(self):
+        token = self.cached_token()
+        if token:
+            return token
+        data = self.load_cached_token() or {}
+        if data.get("refresh_token"):
+            _log.debug("Cached token expired, refreshing")
+            token = self.step_refresh_token(data["refresh_token"])
+            if token:
+                return token
         code = self.step_get_code()
         token = self.step_get_token(code)
         return token
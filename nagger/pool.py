@@ -0,0 +1,23 @@
+"""Thread pool helpers for fanning out GitLab API calls"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 8
+
+
+def map_in_context(func, items, max_workers=MAX_WORKERS):
+    """Call func on every item from a thread pool, returning a list of results
+
+    Each call runs in a copy of the callers context, so bound log state is
+    kept and whatever func binds does not leak between items.
+    """
+    items = list(items)
+    if len(items) < 2:
+        return [contextvars.copy_context().run(func, item) for item in items]
+
+    workers = min(max_workers, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, func, item) for item in items
+        ]
+        return [fut.result() for fut in futures]
@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 """Simple CI helper to remind people to set milestones"""
+import os
+import sys
 from enum import IntEnum
-from dataclasses import dataclass
+from functools import lru_cache
+from operator import attrgetter
+from dataclasses import dataclass, field
 from datetime import timezone, datetime
 from typing import List, Optional
 
-from dateutil.parser import isoparse
-
 from structlog import get_logger
-from structlog.contextvars import bind_contextvars, unbind_contextvars
-from jinja2 import Environment, PackageLoader
-from gitlab.v4.objects import GroupMergeRequest, GroupIssue
+from structlog.contextvars import bind_contextvars
 from .logs import log_state
+from .pool import map_in_context
 from . import GROUP_NAME, RELEASE_PROJECTS, IGNORE_MR_PROJECTS, IGNORE_RELEASE_PROJECTS
+from . import PER_PAGE, graphql, lookup_project
 
 _log = get_logger("nagger")
 
@@ -34,7 +36,7 @@ class Exposed(IntEnum):
     Internal = 1
 
 
-@dataclass(order=True)
+@dataclass
 class ChangeLog:
     """Tracking a changelog line"""
 
@@ -43,27 +45,39 @@ class ChangeLog:
     web_url: str
     labels: List[str]
 
-    @property
-    def kind(self) -> Kind:
+    # Every template asks for these, work them out once per line
+    kind: Kind = field(init=False, compare=False)
+    exposed: Exposed = field(init=False, compare=False)
+
+    def __post_init__(self):
         if "Feature" in self.labels:
-            return Kind.Feature
-        if "Bug" in self.labels:
-            return Kind.Bug
-        return Kind.misc
+            self.kind = Kind.Feature
+        elif "Bug" in self.labels:
+            self.kind = Kind.Bug
+        else:
+            self.kind = Kind.misc
 
-    @property
-    def exposed(self) -> Exposed:
-        """Returns the exposed state of a merge requests"""
-        labels = {x.lower() for x in self.labels}
-        if "internal" in labels:
-            return Exposed.Internal
-        return Exposed.External
+        # The exposed state of a merge request
+        if any(x.lower() == "internal" for x in self.labels):
+            self.exposed = Exposed.Internal
+        else:
+            self.exposed = Exposed.External
 
     @classmethod
     def from_mr(cls, mr):
         slug = mr.references["full"]
         return cls(text=mr.title, slug=f"{slug}", web_url=mr.web_url, labels=mr.labels)
 
+    @classmethod
+    def from_graphql(cls, node):
+        labels = [label["title"] for label in node["labels"]["nodes"]]
+        return cls(
+            text=node["title"],
+            slug=node["reference"],
+            web_url=node["webUrl"],
+            labels=labels,
+        )
+
 
 @dataclass(order=True)
 class ProjectChangelog:
@@ -144,19 +158,28 @@ def present_issue(issue: Issue):
     return f"{emoji} {issue.title} {issue.link} {tasks}"
 
 
+KIND_HEADERS = {
+    Kind.Feature: "New features",
+    Kind.Bug: "Bug fixes",
+    Kind.misc: "Misc changes",
+}
+
+
 def present_kind(val: Kind):
-    if val == Kind.Feature:
-        return "New features"
-    if val == Kind.Bug:
-        return "Bug fixes"
-    if val == Kind.misc:
-        return "Misc changes"
-    return "XXX: "
+    return KIND_HEADERS.get(val, "XXX: ")
+
+
+def group_by_kind(changes: List[ChangeLog]):
+    """Bucket changes per kind in one pass, as (kind, changes) in Kind order"""
+    buckets = {}
+    for change in changes:
+        buckets.setdefault(change.kind, []).append(change)
+    return [(kind, buckets[kind]) for kind in Kind if kind in buckets]
 
 
 def get_milestone(gl, milestone_name):
     bind_contextvars(milestone_name=milestone_name, group_name=GROUP_NAME)
-    group = gl.groups.get(GROUP_NAME)
+    group = gl.groups.get(GROUP_NAME, lazy=True)
     stones = group.milestones.list(title=milestone_name, state="active", as_list=True)
     # let it crash if no stones found
     milestone = stones[0]
@@ -177,27 +200,41 @@ def labels_to_md(labels: List[str]):
     return result
 
 
-def get_template(template_name: str):
+@lru_cache(maxsize=1)
+def get_environment():
+    """The jinja environment, it keeps the compiled templates for the run"""
+    from jinja2 import Environment, PackageLoader
+
     environment = Environment(
         loader=PackageLoader("nagger", "templates"),
         trim_blocks=True,
         lstrip_blocks=True,
+        # Templates ship with the package, they do not change under us
+        auto_reload=False,
     )
     environment.filters["present_kind"] = present_kind
+    environment.filters["by_kind"] = group_by_kind
     environment.filters["present_issue"] = present_issue
     environment.filters["labels2md"] = labels_to_md
     environment.globals["Kind"] = Kind
-    return environment.get_template(template_name)
+    return environment
+
+
+def get_template(template_name: str):
+    return get_environment().get_template(template_name)
+
+
+# Deletes everything a version number may contain
+VERSION_CHARS = str.maketrans("", "", "0123456789.")
 
 
 def is_version(name):
     """Try to see if a name is a version number."""
-    ALL_NUM = set("0123456789.")
     if name[0] in ("v", "V"):
         part = name[1:]
     else:
         part = name
-    return ALL_NUM > set(part)
+    return not part.translate(VERSION_CHARS)
 
 
 def test_is_version():
@@ -216,9 +253,11 @@ def test_is_version():
 def get_milestones(gl):
     """Gets a list of active milestones."""
     bind_contextvars(group_name=GROUP_NAME)
-    group = gl.groups.get(GROUP_NAME)
+    group = gl.groups.get(GROUP_NAME, lazy=True)
     _log.debug("Retrieving milestones")
-    active_milestones = group.milestones.list(state="active", all=True)
+    active_milestones = group.milestones.list(
+        state="active", all=True, per_page=PER_PAGE
+    )
     filtered = (m for m in active_milestones if is_version(m.title))
     result = [m.title for m in filtered]
     return result
@@ -226,15 +265,19 @@ def get_milestones(gl):
 
 def projects_from_project_items(gl, project_items):
     """Look up projects from project_items that have project_id"""
-    projects = {}
+    return projects_from_ids(gl, (item.project_id for item in project_items))
 
-    for item in project_items:
-        if item.project_id in projects:
-            continue
-        _log.info("Looking up project", project_id=item.project_id)
-        project = gl.projects.get(item.project_id)
-        projects[item.project_id] = project
-    return projects
+
+def projects_from_ids(gl, project_ids):
+    """Look up projects by id, mapping of project_id => project object"""
+    project_ids = list(dict.fromkeys(project_ids))
+
+    def lookup(project_id):
+        _log.info("Looking up project", project_id=project_id)
+        return lookup_project(gl, project_id)
+
+    found = map_in_context(lookup, project_ids)
+    return dict(zip(project_ids, found))
 
 
 def projects_from_list(api):
@@ -243,45 +286,123 @@ def projects_from_list(api):
     # Fill up with our "ALWAYS CREATE PROJECT"
     for name in RELEASE_PROJECTS:
         _log.info("Looking up project", project_name=name)
-        proj = api.projects.get(name)
+        proj = lookup_project(api, name)
         _log.msg("Done", project=proj.path_with_namespace)
         projects[proj.id] = proj
     return projects
 
 
-def make_changelog(merge_requests):
-    """Returns a list of ChangeLog items"""
-    result = []
-    for mr in merge_requests:
-        line = ChangeLog.from_mr(mr)
-        result.append(line)
-    return sorted(result)
+MILESTONE_MRS_QUERY = """
+query($group: ID!, $milestone: String, $after: String) {
+  group(fullPath: $group) {
+    mergeRequests(
+      milestoneTitle: $milestone
+      state: merged
+      includeSubgroups: true
+      first: 100
+      after: $after
+    ) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        title
+        webUrl
+        reference(full: true)
+        labels { nodes { title } }
+        milestone { id }
+        project { fullPath }
+      }
+    }
+  }
+}
+"""
 
 
-def make_milestone_changelog(gl, milestone) -> List[ProjectChangelog]:
-    """Grabs all MR for a milestone, returning a Dict mapping to changelogs"""
-    mrs = milestone.merge_requests()
-    merged_mr = [m for m in mrs if m.state == "merged"]
+def milestone_changes_graphql(gl, milestone):
+    """Mapping of project path => [ChangeLog, ...] from a GraphQL query
 
-    # mapping of project_id => project object
-    projects = projects_from_project_items(gl, merged_mr)
-    # mapping of project_id => [ChangeLog, ChangeLog, ...]
+    One request per hundred merge requests, including their project.
+    """
+    # The title filter also matches project milestones with the same title
+    milestone_gid = f"gid://gitlab/Milestone/{milestone.id}"
     changes = {}
+    after = None
+    while True:
+        data = graphql(
+            gl,
+            MILESTONE_MRS_QUERY,
+            group=GROUP_NAME,
+            milestone=milestone.title,
+            after=after,
+        )
+        mrs = data["group"]["mergeRequests"]
+        for node in mrs["nodes"]:
+            if node["milestone"]["id"] != milestone_gid:
+                continue
+            name = node["project"]["fullPath"]
+            changes.setdefault(name, []).append(ChangeLog.from_graphql(node))
+        if not mrs["pageInfo"]["hasNextPage"]:
+            return changes
+        after = mrs["pageInfo"]["endCursor"]
 
-    for mr in merged_mr:
-        changes.setdefault(mr.project_id, [])
-        changes[mr.project_id].append(mr)
 
-    result = []
-    for project_id, merge_requests in changes.items():
-        bind_contextvars(project_id=project_id, num_mrs=len(merge_requests))
-        project = projects[project_id]
+def merged_milestone_mrs(gl, milestone):
+    """List the merged MRs of a group milestone.
+
+    The milestone merge request endpoint cannot filter on state, the group
+    one can filter on both. It filters on the milestone title though, which
+    also matches project milestones with the same title.
+    """
+    group = gl.groups.get(milestone.group_id, lazy=True)
+    mrs = group.mergerequests.list(
+        milestone=milestone.title, state="merged", iterator=True, per_page=PER_PAGE
+    )
+    return [mr for mr in mrs if mr.milestone["id"] == milestone.id]
 
-        changelog = make_changelog(merge_requests)
-        pcl = ProjectChangelog(name=project.path_with_namespace, changes=changelog)
-        result.append(pcl)
-    unbind_contextvars("project_id", "num_mrs")
-    return sorted(result)
+
+def group_project_names(gl, group_id=GROUP_NAME):
+    """Mapping of project_id => path_with_namespace for a group and subgroups
+
+    One listing of the group, rather than a GET per project.
+    """
+    group = gl.groups.get(group_id, lazy=True)
+    projects = group.projects.list(
+        include_subgroups=True, iterator=True, per_page=PER_PAGE
+    )
+    return {p.id: p.path_with_namespace for p in projects}
+
+
+def milestone_changes_rest(gl, milestone):
+    """Mapping of project path => [ChangeLog, ...] from the REST api"""
+    # mapping of project_id => [ChangeLog, ...], built in one pass
+    by_project = {}
+    for mr in merged_milestone_mrs(gl, milestone):
+        by_project.setdefault(mr.project_id, []).append(ChangeLog.from_mr(mr))
+
+    names = group_project_names(gl, milestone.group_id)
+    # Only projects outside the group listing are fetched
+    missing = [pid for pid in by_project if pid not in names]
+    for project_id, project in projects_from_ids(gl, missing).items():
+        names[project_id] = project.path_with_namespace
+    return {names[pid]: changes for pid, changes in by_project.items()}
+
+
+def make_milestone_changelog(gl, milestone) -> List[ProjectChangelog]:
+    """Grabs all merged MR for a milestone, returning project changelogs
+
+    Uses one GraphQL query, set NAGGER_REST to use the REST api instead.
+    """
+    if os.environ.get("NAGGER_REST"):
+        changes = milestone_changes_rest(gl, milestone)
+    else:
+        changes = milestone_changes_graphql(gl, milestone)
+
+    result = []
+    for name, changelog in changes.items():
+        # Slugs are unique, no need to compare the other fields
+        changelog.sort(key=attrgetter("slug"))
+        result.append(ProjectChangelog(name=name, changes=changelog))
+    result.sort(key=attrgetter("name"))
+    return result
 
 
 def load_issues(gl, initial_issues) -> List[Issue]:
@@ -303,7 +424,7 @@ def load_issues(gl, initial_issues) -> List[Issue]:
         _log.debug(
             "load_issue", project_id=project_id, issue_iid=issue_iid, parent=parent
         )
-        project = gl.projects.get(project_id)
+        project = lookup_project(gl, project_id)
         raw = project.issues.get(issue_iid)
         issue = Issue.from_issue(raw, parent=parent)
 
@@ -323,29 +444,47 @@ def load_issues(gl, initial_issues) -> List[Issue]:
     return results
 
 
+# Scissor lines around the part that is meant to be copied
+CUT_START = "--8<--" * 10 + "\n\n"
+CUT_END = "-->8--" * 10 + "\n\n"
+
+
 def milestone_changelog(gl, milestone_name):
     """Stomps all over a milestone"""
     milestone = get_milestone(gl, milestone_name)
     all_changes = make_milestone_changelog(gl, milestone)
 
+    # Stream the templates to stdout rather than rendering whole strings
+    write = sys.stdout.write
     external_md = get_template("external.md")
-    print("--8<--" * 10 + "\n")
+    write(CUT_START)
     for proj in all_changes:
-        templated = external_md.render(project=proj.name, changes=proj.external)
-        print(templated)
-    print("-->8--" * 10 + "\n")
+        external_md.stream(project=proj.name, changes=proj.external).dump(sys.stdout)
+        write("\n")
+    write(CUT_END)
 
     # Internal changes are more concise
-    print("# Internal only changes\n")
+    write("# Internal only changes\n\n")
     internal_md = get_template("internal.md")
     for proj in all_changes:
-        templated = internal_md.render(project=proj.name, changes=proj.changes)
-        print(templated)
+        internal_md.stream(project=proj.name, changes=proj.changes).dump(sys.stdout)
+        write("\n")
     # End internal changes
 
 
+def get_isoparse():
+    """Prefer the C implementation of ISO 8601 parsing, if installed."""
+    try:
+        from ciso8601 import parse_datetime as isoparse
+    except ImportError:
+        from dateutil.parser import isoparse
+    return isoparse
+
+
 def milestone_fixup(gl, milestone_name, pretend=False):
     """Stomps all over a milestone"""
+    isoparse = get_isoparse()
+
     assert milestone_name, "Parameter missing: Milestone name"
     bind_contextvars(pretend=pretend)
 
@@ -363,44 +502,64 @@ def milestone_fixup(gl, milestone_name, pretend=False):
 
     # We don't use the milestone to get the merge requests, as we are
     # interested in all the ones NOT part of the milestone
-    group = gl.groups.get(GROUP_NAME)
+    group = gl.groups.get(GROUP_NAME, lazy=True)
 
-    # Grab all merge requests
-    mrs = group.mergerequests.list(state="merged", all=True)
+    # Grab all merge requests that may have been merged in the window, an MR
+    # merged after start_date was also last updated after it.
+    updated_after = start_date.isoformat()
+    mrs = group.mergerequests.list(
+        state="merged", updated_after=updated_after, iterator=True, per_page=PER_PAGE
+    )
 
-    # mapping of project_id => project object
-    projects = projects_from_project_items(gl, mrs)
-    for proj_id, proj in projects_from_list(gl).items():
-        projects[proj_id] = proj
+    # mapping of project_id => path_with_namespace
+    names = group_project_names(gl)
+    project_ids = {mr.project_id for mr in mrs}
+    project_ids.update(pid for pid, name in names.items() if name in RELEASE_PROJECTS)
 
     # Maybe use dateutil.parse?
 
-    for project in projects.values():
-        with log_state(project=project.path_with_namespace):
-            if project.path_with_namespace in IGNORE_MR_PROJECTS:
+    def fixup_project(project_id):
+        name = names.get(project_id)
+        if name is None:
+            # Not part of the group listing, look it up
+            name = lookup_project(gl, project_id).path_with_namespace
+
+        with log_state(project=name):
+            if name in IGNORE_MR_PROJECTS:
                 _log.msg("Ignoring project")
-                continue
+                return
 
+            # Lazy, we only need it to list and save the merge requests
+            project = gl.projects.get(project_id, lazy=True)
             mrs = project.mergerequests.list(
-                state="merged", order_by="created_at", all=True
+                state="merged",
+                order_by="created_at",
+                updated_after=updated_after,
+                iterator=True,
+                per_page=PER_PAGE,
             )
             mrs = (m for m in mrs if not m.milestone)
 
             for mr in mrs:
+                if not mr.merged_at:
+                    _log.msg("No merged date, ignoring", mr_title=mr.title)
+                    continue
+                merged_at = isoparse(mr.merged_at)
+                # Most merged MR fall outside the window, only bind log state
+                # for the ones we touch.
+                if not start_date < merged_at < due_date:
+                    continue
                 with log_state(mr_title=mr.title, mr_url=mr.web_url):
-                    if not mr.merged_at:
-                        _log.msg("No merged date, ignoring")
-                        continue
-                    merged_at = isoparse(mr.merged_at)
-                    if start_date < merged_at < due_date:
-                        mr.milestone_id = milestone.id
-                        _log.msg("Assigning to milestone")
-                        if not pretend:
-                            try:
-                                mr.save()
-                            except Exception as e:
-                                err = str(e)
-                                _log.error("Failed to update", exception=err)
+                    mr.milestone_id = milestone.id
+                    _log.msg("Assigning to milestone")
+                    if not pretend:
+                        try:
+                            mr.save()
+                        except Exception as e:
+                            err = str(e)
+                            _log.error("Failed to update", exception=err)
+
+    map_in_context(fixup_project, project_ids)
 
 
 def milestone_release(gl, tag_name, dry_run):
@@ -410,83 +569,88 @@ def milestone_release(gl, tag_name, dry_run):
 
     milestone_name = tag_name.rsplit(".", 1)[0]
     milestone = get_milestone(gl, milestone_name)
-    mrs = milestone.merge_requests()
-    merged_mrs = [m for m in mrs if m.state == "merged"]
+    merged_mrs = merged_milestone_mrs(gl, milestone)
 
     projects = projects_from_project_items(gl, merged_mrs)
     for proj_id, proj in projects_from_list(gl).items():
         projects[proj_id] = proj
 
-    changes = {}
-    for project_id in projects:
-        changes.setdefault(project_id, [])
-    del project_id
-
+    # mapping of project_id => [ChangeLog, ...], every project gets a release
+    changes = {project_id: [] for project_id in projects}
     for mr in merged_mrs:
-        changes[mr.project_id].append(mr)
-    del mr, merged_mrs
+        changes[mr.project_id].append(ChangeLog.from_mr(mr))
+    del merged_mrs
+    # Slugs are unique, no need to compare the other fields
+    for changelog in changes.values():
+        changelog.sort(key=attrgetter("slug"))
 
     tag_txt = get_template("project.tag.txt")
     release_md = get_template("project.release.md")
 
-    for project in projects.values():
-        if project.path_with_namespace in IGNORE_RELEASE_PROJECTS:
-            continue
-        bind_contextvars(project=project.path_with_namespace, project_id=project.id)
-        changelog = make_changelog(changes[project.id])
+    def release_project(project):
+        with log_state(project=project.path_with_namespace, project_id=project.id):
+            changelog = changes[project.id]
 
-        tag_message = tag_txt.render(tag_name=tag_name, changes=changelog)
-        release_message = release_md.render(
-            milestone=milestone, tag_name=tag_name, changes=changelog
-        )
+            tag_message = tag_txt.render(tag_name=tag_name, changes=changelog)
+            release_message = release_md.render(
+                milestone=milestone, tag_name=tag_name, changes=changelog
+            )
 
-        proj_name = project.path_with_namespace
-        tag_prefs = {
-            "tag_name": tag_name,
-            "message": tag_message,
-            "ref": project.default_branch,
-        }
-        bind_contextvars(
-            tag_name=tag_name, tag_message=tag_message, tag_ref=project.default_branch
-        )
-        if dry_run:
-            _log.msg("Would create tag")
-        else:
-            try:
-                tag = project.tags.create(tag_prefs)
-                _log.info("Created tag", commit=tag.target)
-                print(f"{proj_name}:  tag: {tag_name} commit: {tag.target}")
-            except Exception as e:
-                err_msg = f"{e.__class__.__name__}: {e}"
-                if DEBUG:
-                    _log.exception("Error creating tag.")
+            proj_name = project.path_with_namespace
+            tag_prefs = {
+                "tag_name": tag_name,
+                "message": tag_message,
+                "ref": project.default_branch,
+            }
+            with log_state(tag_message=tag_message, tag_ref=project.default_branch):
+                if dry_run:
+                    _log.msg("Would create tag")
                 else:
-                    _log.error("Error creating tag.", error=err_msg)
-
-        release_prefs = {
-            "tag_name": tag_name,
-            "name": tag_name,
-            "description": release_message,
-            # We cannot link to Group Milestones by name, thus we pass an empty
-            # milestone in here.  It should be the text representation of a
-            # milestone name according to the documentation that is wrong.
-            "milestones": [],
-        }
-        bind_contextvars(**release_prefs)
-        if not dry_run:
-            try:
-                release = project.releases.create(release_prefs)
-                _log.info("Created release", **release_prefs)
-                print(f"{proj_name}:  tag: {release.tag_name}, release: {release.name}")
-            except Exception as e:
-                err_msg = f"{e.__class__.__name__}: {e}"
-                if DEBUG:
-                    _log.exception("Error creating release.")
-                else:
-                    _log.error("Error creating release.", exception=err_msg)
-        unbind_contextvars(*release_prefs)
-        unbind_contextvars(*tag_prefs)
-    unbind_contextvars("project", "project_id")
+                    try:
+                        tag = project.tags.create(tag_prefs)
+                        _log.info("Created tag", commit=tag.target)
+                        print(f"{proj_name}:  tag: {tag_name} commit: {tag.target}")
+                    except Exception as e:
+                        err_msg = f"{e.__class__.__name__}: {e}"
+                        if DEBUG:
+                            _log.exception("Error creating tag.")
+                        else:
+                            _log.error("Error creating tag.", error=err_msg)
+
+            release_prefs = {
+                "tag_name": tag_name,
+                "name": tag_name,
+                "description": release_message,
+                # We cannot link to Group Milestones by name, thus we pass an
+                # empty milestone in here.  It should be the text
+                # representation of a milestone name according to the
+                # documentation that is wrong.
+                "milestones": [],
+            }
+            # tag_name is already bound for the whole run
+            with log_state(name=tag_name, description=release_message, milestones=[]):
+                if not dry_run:
+                    try:
+                        release = project.releases.create(release_prefs)
+                        _log.info("Created release", **release_prefs)
+                        print(
+                            f"{proj_name}:  tag: {release.tag_name}, "
+                            f"release: {release.name}"
+                        )
+                    except Exception as e:
+                        err_msg = f"{e.__class__.__name__}: {e}"
+                        if DEBUG:
+                            _log.exception("Error creating release.")
+                        else:
+                            _log.error("Error creating release.", exception=err_msg)
+
+    # Projects are tagged and released independently of each other
+    to_release = (
+        p
+        for p in projects.values()
+        if p.path_with_namespace not in IGNORE_RELEASE_PROJECTS
+    )
+    map_in_context(release_project, to_release)
 
 
 WWW_PROJECT = "ModioAB/modio.se"
@@ -517,7 +681,7 @@ def changelog_homepage(gl, milestone_name, dry_run=True, www_project=WWW_PROJECT
         projects=all_changes,
         description=description,
     )
-    project = gl.projects.get(www_project)
+    project = lookup_project(gl, www_project)
     if dry_run:
         print("DRY RUN:", file_path)
         print(content)
@@ -577,7 +741,7 @@ def milestone_wiki(gl, milestone_name, dry_run=True, wiki_project_name=WIKI_PROJ
     mermaid_title = f"Milestones/{milestone_name}"
 
     # prefer wiki_project-project milestone
-    wiki_project = gl.projects.get(wiki_project_name)
+    wiki_project = lookup_project(gl, wiki_project_name)
     mss = wiki_project.milestones.list(
         title=milestone_name, state="active", as_list=True
     )
@@ -615,7 +779,7 @@ def ensure_wiki_page_with_content(gl, wiki_project_name, title, content, dry_run
     from gitlab.exceptions import GitlabUpdateError
 
     bind_contextvars(wiki_project_name=wiki_project_name, wiki_title=title)
-    wiki_project = gl.projects.get(wiki_project_name)
+    wiki_project = lookup_project(gl, wiki_project_name)
     wikis = wiki_project.wikis
 
     bind_contextvars(wiki_page_title=title)
@@ -623,7 +787,10 @@ def ensure_wiki_page_with_content(gl, wiki_project_name, title, content, dry_run
     try:
         page = wikis.get(title)
         bind_contextvars(action="Update page", slug=page.slug)
-    except GitlabGetError:
+    except GitlabGetError as ex:
+        # Only a missing page should be created, anything else is an error
+        if ex.response_code != 404:
+            raise
         bind_contextvars(action="Create new")
 
     if dry_run:
@@ -633,6 +800,11 @@ def ensure_wiki_page_with_content(gl, wiki_project_name, title, content, dry_run
 
     if page is None:
         wikis.create({"title": title, "content": content})
+    elif page.content == content and page.title == title.rsplit("/", 1)[-1]:
+        # Saving would only add an identical revision to the page history.
+        # Pages in a wiki directory only get the last path segment as title
+        _log.msg("wiki page already up to date")
+        return
     else:
         page.content = content
         page.title = title
@@ -648,19 +820,23 @@ def ensure_wiki_page_with_content(gl, wiki_project_name, title, content, dry_run
 def move_opened_items_between_milestones(
     gl, from_milestone_name, target_milestone_name, dry_run=True
 ):
+    from gitlab.v4.objects import GroupMergeRequest, GroupIssue
+
     stone = get_milestone(gl, from_milestone_name)
     # just to crash early if missing
     target = get_milestone(gl, target_milestone_name)
 
     bind_contextvars(milestone_target=target.title)
     bind_contextvars(milestone_name=stone.title)
-    group = gl.groups.get(GROUP_NAME)
+    group = gl.groups.get(GROUP_NAME, lazy=True)
 
     count = 0
 
-    group_issues = group.issues.list(state="opened", milestone=stone.title, all=True)
+    group_issues = group.issues.list(
+        state="opened", milestone=stone.title, all=True, per_page=PER_PAGE
+    )
     group_mrs = group.mergerequests.list(
-        state="opened", milestone=stone.title, all=True
+        state="opened", milestone=stone.title, all=True, per_page=PER_PAGE
     )
     all_items = group_issues + group_mrs
     projects = projects_from_project_items(gl, all_items)
@@ -670,14 +846,15 @@ def move_opened_items_between_milestones(
         count = count + 1
         project = projects[group_item.project_id]
         # `group_item` is now a GroupIssue or GroupMergeRequest
-        # we have to re-load to be a ProjectIssue or ProjectMergeRequest
-        # to have `save()`
+        # we need a ProjectIssue or ProjectMergeRequest to have `save()`,
+        # a lazy one is enough as only the milestone is sent.
         if isinstance(group_item, GroupMergeRequest):
-            item = project.mergerequests.get(group_item.iid)
+            item = project.mergerequests.get(group_item.iid, lazy=True)
         elif isinstance(group_item, GroupIssue):
-            item = project.issues.get(group_item.iid)
+            item = project.issues.get(group_item.iid, lazy=True)
         else:
-            _log.err(f"group_item has bad type: {type(item)}")
+            _log.error(f"group_item has bad type: {type(group_item)}")
+            continue
 
         item.milestone_id = target.id
         _log.msg(f"will update: {item._get_updated_data()}")
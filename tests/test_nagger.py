@@ -4,9 +4,16 @@
 """Tests for `nagger` package."""
 
 
+import io
+import sys
 import unittest
+from types import SimpleNamespace
+from unittest import mock
 
 import nagger
+from nagger.logs import QueueLoggerFactory
+from nagger.pool import map_in_context
+from structlog.contextvars import bind_contextvars, get_contextvars
 
 
 class TestNagger(unittest.TestCase):
@@ -21,3 +28,300 @@ class TestNagger(unittest.TestCase):
     def test_000_something(self):
         """Test something."""
         assert nagger
+
+    def test_queue_logger_drains_on_stop(self):
+        """Queued log lines are all written once the factory stops."""
+        out = io.StringIO()
+        factory = QueueLoggerFactory(out)
+        logger = factory()
+        logger.msg("first")
+        logger.info("second")
+        factory.stop()
+        self.assertEqual(out.getvalue(), "first\nsecond\n")
+
+    def test_queue_logger_drains_before_traceback(self):
+        """Log lines are written before the traceback, and after stopping."""
+        out = io.StringIO()
+        factory = QueueLoggerFactory(out)
+        logger = factory()
+
+        def excepthook(*exc_info):
+            out.write("Traceback\n")
+
+        with mock.patch("sys.excepthook", excepthook), mock.patch("signal.signal"):
+            factory.stop_on_crash()
+            logger.msg("failing")
+            sys.excepthook(RuntimeError, RuntimeError(), None)
+        logger.msg("late")
+        self.assertEqual(out.getvalue(), "failing\nTraceback\nlate\n")
+
+    def test_map_in_context_keeps_order_and_log_state(self):
+        """Threaded map returns results in order with the callers context."""
+        bind_contextvars(milestone_name="v3.14")
+
+        def work(item):
+            bind_contextvars(item=item)
+            return item, get_contextvars()["milestone_name"]
+
+        result = map_in_context(work, range(20))
+        self.assertEqual(result, [(i, "v3.14") for i in range(20)])
+        self.assertNotIn("item", get_contextvars())
+
+        # A single item runs without threads, but still in a copied context
+        self.assertEqual(map_in_context(work, [7]), [(7, "v3.14")])
+        self.assertNotIn("item", get_contextvars())
+
+    def test_lookup_project_by_id_and_path(self):
+        """A project is fetched once, then found by id or path."""
+        gl = mock.Mock()
+        gl.projects.get.return_value = SimpleNamespace(
+            id=4711, path_with_namespace="ModioAB/lookup-test"
+        )
+        first = nagger.lookup_project(gl, 4711)
+        self.assertIs(nagger.lookup_project(gl, "ModioAB/lookup-test"), first)
+        self.assertIs(nagger.lookup_project(gl, 4711), first)
+        gl.projects.get.assert_called_once_with(4711)
+
+    def test_milestone_release_without_merged_mrs(self):
+        """A milestone with nothing merged still renders "No major changes"."""
+        from nagger import release
+
+        project = mock.Mock(id=1, path_with_namespace="ModioAB/empty")
+        with mock.patch.multiple(
+            release,
+            get_milestone=mock.DEFAULT,
+            merged_milestone_mrs=mock.Mock(return_value=[]),
+            projects_from_list=mock.Mock(return_value={1: project}),
+        ):
+            release.milestone_release(mock.Mock(), "v3.14.0", dry_run=False)
+        (tag_prefs,), _ = project.tags.create.call_args
+        self.assertEqual(tag_prefs["tag_name"], "v3.14.0")
+        self.assertIn("No major changes", tag_prefs["message"])
+        (release_prefs,), _ = project.releases.create.call_args
+        self.assertIn("No major changes", release_prefs["description"])
+
+    def test_oauth_refreshes_expired_token(self):
+        """An expired cached token is refreshed instead of asking the browser."""
+        import json
+        import tempfile
+        from nagger import oauth
+
+        with tempfile.TemporaryDirectory() as cache_home, mock.patch.dict(
+            "os.environ", {"XDG_CACHE_HOME": cache_home}
+        ), mock.patch.object(oauth, "make_session"):
+            oa = oauth.GLOauth()
+            oa.save_token(
+                {
+                    "access_token": "old",
+                    "refresh_token": "refresh",
+                    "expires_in": 7200,
+                    "created_at": 0,
+                }
+            )
+            oa.session.post.return_value.json.return_value = {
+                "access_token": "new",
+                "refresh_token": "next",
+                "expires_in": 7200,
+            }
+            with mock.patch.object(oa, "step_get_code") as browser:
+                self.assertEqual(oa.get_token(), "new")
+            browser.assert_not_called()
+            cached = json.loads(oauth.token_cache_path().read_text())
+            self.assertEqual(cached["refresh_token"], "next")
+            self.assertEqual(oa.get_token(), "new")
+
+    def test_oauth_revoked_token_logs_in_again(self):
+        """A rejected cached token is dropped and a new one fetched, only once."""
+        import os
+        import stat
+        import tempfile
+        from gitlab.exceptions import GitlabAuthenticationError
+        from nagger import oauth
+
+        with tempfile.TemporaryDirectory() as cache_home, mock.patch.dict(
+            "os.environ", {"XDG_CACHE_HOME": cache_home}
+        ), mock.patch.object(oauth, "make_session"):
+            path = oauth.token_cache_path()
+            path.parent.mkdir(parents=True)
+            path.write_text("{}")
+            os.chmod(path, 0o644)
+            oauth.GLOauth().save_token({"access_token": "revoked"})
+            self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o600)
+
+            with mock.patch("gitlab.Gitlab") as gitlab, mock.patch.object(
+                oauth.GLOauth, "step_get_code"
+            ), mock.patch.object(oauth.GLOauth, "step_get_token", return_value="fresh"):
+                gitlab.return_value.auth.side_effect = [
+                    GitlabAuthenticationError("401 Unauthorized"),
+                    None,
+                ]
+                nagger.get_oauth_gitlab.__wrapped__()
+            tokens = [kw["oauth_token"] for _, kw in gitlab.call_args_list]
+            self.assertEqual(tokens, ["revoked", "fresh"])
+            self.assertFalse(path.exists())
+
+            # Without a cached token there is nothing to retry
+            with mock.patch("gitlab.Gitlab") as gitlab, mock.patch.object(
+                oauth.GLOauth, "step_get_code"
+            ), mock.patch.object(oauth.GLOauth, "step_get_token", return_value="fresh"):
+                gitlab.return_value.auth.side_effect = GitlabAuthenticationError()
+                with self.assertRaises(GitlabAuthenticationError):
+                    nagger.get_oauth_gitlab.__wrapped__()
+            self.assertEqual(gitlab.call_count, 1)
+
+    def test_make_pending_wip_skips_save_when_already_marked(self):
+        """An MR that is already WIP and Pending is not saved again."""
+        from nagger.ci_bot import make_pending_wip
+
+        mr = mock.Mock(title="WIP: x", work_in_progress=True, labels=["Pending"])
+        self.assertTrue(make_pending_wip(mr))
+        mr.save.assert_not_called()
+        self.assertEqual((mr.title, mr.labels), ("WIP: x", ["Pending"]))
+
+    def test_make_pending_wip_rolls_back_failed_save(self):
+        """A rejected save leaves the title and labels as they were."""
+        from nagger.ci_bot import make_pending_wip
+
+        mr = mock.Mock(title="x", work_in_progress=False, labels=["Ready"])
+        mr.save.side_effect = Exception("403 Forbidden")
+        self.assertFalse(make_pending_wip(mr))
+        mr.save.assert_called_once_with()
+        self.assertEqual((mr.title, mr.labels), ("x", ["Ready"]))
+
+    def test_make_pending_wip_swaps_ready_keeping_label_order(self):
+        """Ready turns into Pending in one save, other labels keep their order."""
+        from nagger.ci_bot import make_pending_wip
+
+        mr = mock.Mock(title="x", work_in_progress=False, labels=["b", "Ready", "a"])
+        self.assertTrue(make_pending_wip(mr))
+        mr.save.assert_called_once_with()
+        self.assertEqual(mr.title, "WIP: x")
+        self.assertEqual(mr.labels, ["b", "a", "Pending"])
+
+    def test_milestone_changelog_graphql_pages(self):
+        """GraphQL pages are followed and lines grouped by project."""
+        from nagger import release
+
+        def node(ref, title, labels, milestone_id=5):
+            return {
+                "title": title,
+                "webUrl": f"https://gitlab.com/{ref}",
+                "reference": ref,
+                "labels": {"nodes": [{"title": label} for label in labels]},
+                "milestone": {"id": f"gid://gitlab/Milestone/{milestone_id}"},
+                "project": {"fullPath": ref.split("!")[0]},
+            }
+
+        def page(nodes, end_cursor=None):
+            return {
+                "group": {
+                    "mergeRequests": {
+                        "pageInfo": {
+                            "hasNextPage": end_cursor is not None,
+                            "endCursor": end_cursor,
+                        },
+                        "nodes": nodes,
+                    }
+                }
+            }
+
+        pages = [
+            page(
+                [
+                    node("ModioAB/b!2", "Fix", ["Bug"]),
+                    node("ModioAB/a!1", "Other", [], milestone_id=6),
+                ],
+                end_cursor="c1",
+            ),
+            page([node("ModioAB/b!1", "New", ["Feature", "Internal"])]),
+        ]
+        milestone = SimpleNamespace(id=5, title="v3.14")
+        with mock.patch.object(release, "graphql", side_effect=pages) as graphql:
+            result = release.make_milestone_changelog(mock.Mock(), milestone)
+
+        afters = [kw["after"] for _, kw in graphql.call_args_list]
+        self.assertEqual(afters, [None, "c1"])
+        self.assertEqual([p.name for p in result], ["ModioAB/b"])
+        self.assertEqual(
+            [c.slug for c in result[0].changes], ["ModioAB/b!1", "ModioAB/b!2"]
+        )
+
+        mr = SimpleNamespace(
+            title="New",
+            web_url="https://gitlab.com/ModioAB/b!1",
+            references={"full": "ModioAB/b!1"},
+            labels=["Feature", "Internal"],
+        )
+        self.assertEqual(result[0].changes[0], release.ChangeLog.from_mr(mr))
+        self.assertEqual(result[0].changes[0].kind, release.Kind.Feature)
+
+    def test_milestone_changelog_rest_fallback(self):
+        """NAGGER_REST uses the REST api, naming projects outside the group."""
+        from nagger import release
+
+        def mr(ref, title, labels, project_id, milestone_id=5):
+            return SimpleNamespace(
+                title=title,
+                web_url=f"https://gitlab.com/{ref}",
+                references={"full": ref},
+                labels=labels,
+                project_id=project_id,
+                milestone={"id": milestone_id},
+            )
+
+        gl = mock.Mock()
+        group = gl.groups.get.return_value
+        group.mergerequests.list.return_value = [
+            mr("ModioAB/b!2", "Fix", ["Bug"], 2),
+            mr("ModioAB/a!1", "Other", [], 1, milestone_id=6),
+            mr("Other/c!1", "New", ["Feature"], 3),
+        ]
+        group.projects.list.return_value = [
+            SimpleNamespace(id=1, path_with_namespace="ModioAB/a"),
+            SimpleNamespace(id=2, path_with_namespace="ModioAB/b"),
+        ]
+        outside = {3: SimpleNamespace(path_with_namespace="Other/c")}
+        projects_from_ids = mock.Mock(return_value=outside)
+        milestone = SimpleNamespace(id=5, title="v3.14", group_id=4)
+        with mock.patch.dict("os.environ", {"NAGGER_REST": "1"}):
+            with mock.patch.multiple(
+                release,
+                graphql=mock.DEFAULT,
+                projects_from_ids=projects_from_ids,
+            ) as patched:
+                result = release.make_milestone_changelog(gl, milestone)
+
+        patched["graphql"].assert_not_called()
+        projects_from_ids.assert_called_once_with(gl, [3])
+        self.assertEqual([p.name for p in result], ["ModioAB/b", "Other/c"])
+        self.assertEqual([c.slug for c in result[1].changes], ["Other/c!1"])
+
+    def test_wiki_page_in_directory_not_saved_when_unchanged(self):
+        """Nested pages come back titled by their last path segment."""
+        from nagger import release
+
+        page = mock.Mock(slug="Releases/v3.14", title="v3.14", content="Notes")
+        project = mock.Mock()
+        project.wikis.get.return_value = page
+        with mock.patch.object(release, "lookup_project", return_value=project):
+            release.ensure_wiki_page_with_content(
+                mock.Mock(), "ModioAB/wiki", "Releases/v3.14", "Notes", dry_run=False
+            )
+        page.save.assert_not_called()
+
+    def test_debug_variables_does_not_set_up_logging(self):
+        """debug-variables runs without configuring logging, others do."""
+        from click.testing import CliRunner
+        from nagger import cli
+
+        with mock.patch.object(cli, "setup_logging") as setup_logging:
+            result = CliRunner().invoke(cli.cli, ["debug-variables"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            setup_logging.assert_not_called()
+
+            with mock.patch("nagger.ci_bot.release_tag"), mock.patch.object(
+                cli, "get_env_gitlab"
+            ):
+                result = CliRunner().invoke(cli.cli, ["tag-to-release"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            setup_logging.assert_called_once_with()